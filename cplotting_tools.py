@@ -5,6 +5,11 @@ Created on Tue Jul  7 13:05:40 2020
 @author: artmenlope
 """
 
+import os
+import hashlib
+import functools
+import inspect
+import tempfile
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
@@ -13,7 +18,83 @@ import cmath
 
 
 
-def colorize(f, a=0.5, log_brightness=True, log_contrast=0.4):
+def _pixel_gradient(u, periodic=False):
+    
+    """
+    Auxiliar function for the isoline shading.
+    
+    Returns the magnitude of the gradient of u in units of u 
+    per pixel. If periodic is True, u is taken modulo 1, so 
+    integer jumps between neighbouring pixels are ignored.
+    """
+    
+    g = np.zeros(u.shape)
+    
+    for axis in range(u.ndim):
+        if u.shape[axis] < 2:
+            continue
+        d = np.diff(u, axis=axis)
+        if periodic == True:
+            d = d - np.round(d)
+        d = np.abs(d)
+        # Average the forward and backward differences.
+        first = np.take(d, [0], axis=axis)
+        last = np.take(d, [-1], axis=axis)
+        d = np.concatenate([first, d, last], axis=axis)
+        d = 0.5*(np.take(d, range(0, u.shape[axis]), axis=axis) + np.take(d, range(1, u.shape[axis]+1), axis=axis))
+        g = g + d**2
+        
+    return np.sqrt(g)
+
+
+
+def _isoline_intensity(u, width=1, periodic=False, pixel_scale=1):
+    
+    """
+    Auxiliar function for the isoline shading.
+    
+    Returns, for every pixel, the anti-aliased coverage (from 
+    0 to 1) of the lines where u takes integer values. The 
+    distance to the nearest line is measured in pixels using 
+    the local gradient of u, and the lines fade out where they 
+    get closer than a few pixels to avoid moire patterns. If u 
+    has pixel_scale samples per output pixel along each axis, 
+    distances are measured in output pixels.
+    """
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        g = pixel_scale*_pixel_gradient(u, periodic)
+        dist = np.abs(u - np.round(u))/g # Distance to the nearest line in pixels.
+        coverage = np.clip(0.5*width + 0.5 - dist, 0, 1)
+        fade = np.clip(0.5/g - 1, 0, 1) # Full lines if spaced 4 pixels or more, none below 2.
+        
+    return np.nan_to_num(coverage*fade)
+
+
+
+def _hls_to_rgb(H, L, S):
+    
+    """
+    Auxiliar function for colorize. Vectorized version of 
+    colorsys.hls_to_rgb working on whole numpy arrays.
+    """
+    
+    m2 = np.where(L <= 0.5, L*(1+S), L+S-L*S)
+    m1 = 2*L - m2
+    
+    def channel(hue):
+        hue = np.mod(hue, 1)
+        return np.select([hue < 1/6, hue < 0.5, hue < 2/3],
+                         [m1+(m2-m1)*hue*6, m2, m1+(m2-m1)*(2/3-hue)*6],
+                         default=m1)
+    
+    return channel(H+1/3), channel(H), channel(H-1/3)
+
+
+
+def colorize(f, a=0.5, log_brightness=True, log_contrast=0.4, 
+             isolines=False, n_phase=12, modulus_base=2, line_width=1, 
+             pixel_scale=1):
     
     """
     Auxiliar function for creating domain coloring plots.
@@ -38,10 +119,27 @@ def colorize(f, a=0.5, log_brightness=True, log_contrast=0.4):
                           the module of f increases.
 
         log_contrast :: Float. Parameter for the brightness.
+
+        isolines :: Boolean. If True, darken the colors along 
+                    lines of constant phase and constant module 
+                    ("enhanced phase portrait"). The lines are 
+                    drawn per pixel, no contour tracing is done.
+
+        n_phase :: Integer. Number of lines of constant phase 
+                   (evenly spaced in the phase of f).
+
+        modulus_base :: Float greater than 1. A line of constant 
+                        module is drawn each time the module of 
+                        f is multiplied by this number.
+
+        line_width :: Float. Width of the isolines in pixels.
+
+        pixel_scale :: Integer. Number of samples of f per output 
+                       pixel along each axis (when f is supersampled). 
+                       The width and the spacing of the isolines are 
+                       measured in output pixels.
     """
 
-    from colorsys import hls_to_rgb
-    
     def logb(arg, base):
         """Return the logarithm with base b of arg."""
         return np.log(base) / np.log(base)
@@ -54,23 +152,174 @@ def colorize(f, a=0.5, log_brightness=True, log_contrast=0.4):
     if log_brightness == True:
         L = 1-a**np.log(1+np.abs(f)**log_contrast)
         
+    if isolines == True:
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            phase = n_phase*np.mod(np.angle(f),2*np.pi)/(2*np.pi) # Phase lines at integer values.
+            modulus = np.log(np.abs(f))/np.log(modulus_base) # Module lines at integer values.
+        
+        shade = np.maximum(_isoline_intensity(phase, line_width, True, pixel_scale), 
+                           _isoline_intensity(modulus, line_width, False, pixel_scale))
+        L = L*(1-0.7*shade)
+        
     S = 1 # Saturation.
     
-    c = np.vectorize(hls_to_rgb)(H, L, S) # --> Tuple.
-    c = np.array(c)  # The array of colors c is of shape (3,n,m), but it needs to be (m,n,3).
-    c = np.rot90(c.transpose(2,1,0), 1) # Change shape to (m,n,3) and rotate 90 degrees as correction.
+    c = np.stack(_hls_to_rgb(H, L, S), axis=-1) # Array of colors of shape (n,m,3).
+    c = c[::-1] # Flip the rows as correction (the image is drawn with origin="upper").
     
     return c
 
 
 
+def _grid(x, y, shape=None, extent=None):
+    
+    """
+    Auxiliar function for handling the plotting space.
+    
+    x and y can be 2D meshgrids or 1D axis vectors. They can 
+    also be None if the extent (xmin, xmax, ymin, ymax) and the 
+    shape of the evaluated function are given. 1D vectors are 
+    returned as a row and a column that broadcast against each 
+    other, so no meshgrid is built. Also returns the extent of 
+    the plotting space.
+    """
+    
+    if extent is not None:
+        if shape is None:
+            raise ValueError("An explicit extent needs f evaluated as a 2D array. Pass 1D x and y vectors for a callable f.")
+        xmin, xmax, ymin, ymax = extent
+        x = np.linspace(xmin, xmax, shape[-1])
+        y = np.linspace(ymin, ymax, shape[-2])
+    elif x is None or y is None:
+        raise ValueError("Either x and y or extent is required.")
+    
+    x, y = np.asarray(x), np.asarray(y)
+    if x.ndim == 1:
+        x = x[np.newaxis,:]
+    if y.ndim == 1:
+        y = y[:,np.newaxis]
+        
+    extent = [x[0,0], x[0,-1], y[0,0], y[-1,0]]
+    
+    return x, y, extent
+
+
+
+def _progressive_samples(z, f, strides=(4, 2, 1)):
+    
+    """
+    Auxiliar generator for the progressive rendering mode.
+    
+    Evaluates the callable f over z in coarse-to-fine passes. 
+    In each pass only the points of the new lattice that were 
+    not evaluated in a previous pass are computed, so the total 
+    number of evaluations is the same as evaluating f once 
+    over z. Yields the samples of the current lattice and its 
+    extent, which is smaller than the extent of z when the last 
+    row or column of z is not on the lattice.
+    """
+    
+    values = np.full(z.shape, np.nan, dtype=complex)
+    done = np.zeros(z.shape, dtype=bool)
+    
+    for stride in strides:
+        new = np.zeros(z.shape, dtype=bool)
+        new[::stride, ::stride] = True
+        new &= ~done
+        values[new] = f(z[new])
+        done |= new
+        corners = z[::stride, ::stride][[0, -1], :][:, [0, -1]]
+        extent = [corners[0,0].real, corners[0,1].real, corners[0,0].imag, corners[1,0].imag]
+        yield values[::stride, ::stride], extent
+
+
+
+def _supersampled_image(x, y, f, render, k, jitter=False, band_rows=None, workers=1, halo=False):
+    
+    """
+    Auxiliar function for the supersampled domain coloring plots.
+    
+    Evaluates the callable f with k*k samples per pixel of the 
+    grid given by x and y (the pixel centers) and converts them 
+    to colors with render. The image is built in bands of rows 
+    and each band is reduced to the output resolution right away, 
+    so the memory used is that of the output image. The samples 
+    are placed on a regular subgrid inside each pixel, randomly 
+    jittered if jitter is True. The bands can be processed in 
+    parallel by several threads. If render needs the neighbours 
+    of each sample (halo is True, e.g. for the isolines), each 
+    band is evaluated with one extra row of samples at each side.
+    """
+    
+    from concurrent.futures import ThreadPoolExecutor
+    
+    xs, ys = x[0,:], y[:,0]
+    n_rows, n_cols = len(ys), len(xs)
+    dx = (xs[-1]-xs[0])/(n_cols-1) if n_cols > 1 else 0
+    dy = (ys[-1]-ys[0])/(n_rows-1) if n_rows > 1 else 0
+    offsets = (np.arange(k)+0.5)/k - 0.5 # Subsample positions inside a pixel.
+    
+    xs_fine = (xs[:,np.newaxis] + dx*offsets).ravel()
+    
+    # By default the bands being processed at the same time hold 
+    # about as many samples as the output image.
+    if band_rows is None:
+        band_rows = max(1, n_rows//(k*k*workers))
+        if halo == True:
+            # At least 16 rows of samples, so the halo costs 1/8 at most.
+            band_rows = max(band_rows, -(-16//k))
+    bands = [(i, min(i+band_rows, n_rows)) for i in range(0, n_rows, band_rows)]
+    
+    image = None
+    
+    def run(band):
+        nonlocal image
+        
+        start, stop = band
+        ys_fine = (ys[start:stop,np.newaxis] + dy*offsets).ravel()
+        
+        # Add one row of samples at each side, so that the colors 
+        # near the edges of the band see their neighbours.
+        if halo == True:
+            ys_fine = np.concatenate([ys_fine[:1]-dy/k, ys_fine, ys_fine[-1:]+dy/k])
+        
+        z = xs_fine[np.newaxis,:] + 1j*ys_fine[:,np.newaxis]
+        if jitter == True:
+            rng = np.random.default_rng(start)
+            z = z + (dx*rng.uniform(-0.5, 0.5, z.shape) + 1j*dy*rng.uniform(-0.5, 0.5, z.shape))/k
+        
+        colors = np.asarray(render(f(z)))
+        if halo == True:
+            colors = colors[1:-1]
+        colors = colors.reshape(stop-start, k, n_cols, k, -1).mean(axis=(1,3))
+        
+        if image is None:
+            image = np.empty((n_rows, n_cols, colors.shape[-1]))
+        image[start:stop] = colors
+    
+    # The first band runs alone to set up the image.
+    run(bands[0])
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run, bands[1:]))
+    
+    return image
+
+
+
 def domain_coloring(x, y, f, 
                    figsize=(12,8),
                    xlabel="Re", 
                    ylabel="Im",
                    title=None,
                    grid=False,
-                   cmap="hsv"):
+                   cmap="hsv",
+                   progressive=False,
+                   extent=None,
+                   supersample=1,
+                   jitter=False,
+                   band_rows=None,
+                   workers=1):
     
     """
     Domain coloring plot. 
@@ -81,20 +330,58 @@ def domain_coloring(x, y, f,
     See https://en.wikipedia.org/wiki/Domain_coloring for more 
     information.
 
-    x, y, f are 2D arrays. f can contain complex numbers.
+    x, y are 2D meshgrids or 1D axis vectors. Alternatively, 
+    they can be None and the plotting space can be given as 
+    extent=(xmin, xmax, ymin, ymax).
+    f is a 2D array that can contain complex numbers. It can 
+    also be a callable of z = x + 1j*y, which is then 
+    evaluated over the grid.
     figsize, xlabel, ylabel, title, grid and cmap are parameters 
     for the Matplotlib plot.
+    
+    If progressive is True, f must be an elementwise callable. 
+    A 1/16 resolution preview is drawn first and then refined 
+    in passes (1/4, then full resolution) reusing the samples 
+    already computed.
+    
+    If supersample is greater than 1, f must be an elementwise 
+    callable. Each pixel is then the average color of 
+    supersample*supersample samples of f (randomly placed inside 
+    the pixel if jitter is True), which removes the moire near 
+    poles and essential singularities. The image is computed in 
+    bands of band_rows rows, reduced to the output resolution one 
+    at a time, using workers threads.
     """
     
-    arg_f = np.mod(np.angle(f),2*np.pi) # np.mod ensures argument from 0 to 2*pi
-    lim = np.max([x, y])
+    if progressive == True and supersample > 1:
+        raise ValueError("progressive and supersample cannot be used together.")
+    if supersample > 1 and not callable(f):
+        raise ValueError("supersample needs f as a callable of z.")
+    
+    if progressive == True and not callable(f):
+        raise ValueError("progressive needs f as a callable of z.")
+    
+    x, y, extent = _grid(x, y, None if callable(f) else np.shape(f), extent)
+    img_extent = extent
+    
+    if progressive == True:
+        samples = _progressive_samples(x + 1j*y, f)
+        f, img_extent = next(samples)
+    elif callable(f) and supersample == 1:
+        f = f(x + 1j*y)
 
     # Prepare for using colormaps.
     norm = matplotlib.colors.Normalize(vmin=0,vmax=2*np.pi)
     c_m = cmap # "twilight", "hsv"
     s_m = matplotlib.cm.ScalarMappable(cmap=c_m, norm=norm)
     s_m.set_array([])
-    fcolors = s_m.to_rgba(arg_f)
+    
+    if supersample > 1:
+        # Average the colors, not the phases.
+        img = _supersampled_image(x, y, f, lambda f: s_m.to_rgba(np.mod(np.angle(f),2*np.pi)), 
+                                  supersample, jitter, band_rows, workers)
+    else:
+        img = np.mod(np.angle(f),2*np.pi) # np.mod ensures argument from 0 to 2*pi
     
     # A figure and a 3d subplot.
     fig = plt.figure(figsize=figsize)
@@ -103,8 +390,8 @@ def domain_coloring(x, y, f,
     ax.set_ylabel(ylabel, fontsize=14)
     
     # Limit corrections.
-    ax.set_xlim((-lim,lim))
-    ax.set_ylim((-lim,lim))
+    ax.set_xlim(extent[:2])
+    ax.set_ylim(extent[2:])
     
     # Grid and title.
     ax.grid(grid)
@@ -112,13 +399,23 @@ def domain_coloring(x, y, f,
     if title is not None:
         ax.set_title(title, fontsize=18, pad=20, usetex=False)
         
-    ax.imshow(arg_f, cmap=cmap, extent=[-lim,lim,-lim,lim], interpolation="none", origin="lower")
+    im = ax.imshow(img, cmap=cmap, norm=norm, extent=img_extent, interpolation="none", origin="lower")
    
     # Draw the colorbar.
     cbar = plt.colorbar(s_m, ticks=[0, np.pi/2, np.pi, 3*np.pi/2, 2*np.pi], pad=0.1)
     cbar.ax.set_yticklabels(["$0$", "$\\frac{\\pi}{2}$", "$\\pi$", "$\\frac{3\\pi}{2}$", "$2\\pi$"], fontsize=16)
     
     plt.tight_layout()
+    
+    # Refine the preview in place.
+    if progressive == True:
+        plt.show(block=False)
+        plt.pause(0.001)
+        for f, img_extent in samples:
+            im.set_data(np.mod(np.angle(f),2*np.pi))
+            im.set_extent(img_extent)
+            plt.pause(0.001)
+    
     plt.show()
 
 
@@ -131,7 +428,16 @@ def domain_coloring_illuminated(x, y, f,
                                 xlabel="Re", 
                                 ylabel="Im",
                                 title=None,
-                                grid=False):
+                                grid=False,
+                                progressive=False,
+                                isolines=False,
+                                n_phase=12,
+                                modulus_base=2,
+                                extent=None,
+                                supersample=1,
+                                jitter=False,
+                                band_rows=None,
+                                workers=1):
     
     """
     Domain coloring plot. 
@@ -145,10 +451,17 @@ def domain_coloring_illuminated(x, y, f,
 
     Arguments:
 
-        x, y :: 2D arrays. They represent the 2D plotting space.
+        x, y :: 2D meshgrids or 1D axis vectors. They represent 
+                the 2D plotting space. They can be None if extent 
+                is given.
 
         f :: 2D numpy array of complex numbers. Evaluated 
-             function to be plotted.
+             function to be plotted. It can also be a callable 
+             of z = x + 1j*y, which is then evaluated over the 
+             grid.
+
+        extent :: Tuple (xmin, xmax, ymin, ymax). Plotting space 
+                  of an evaluated f, used instead of x and y.
 
         a :: Float between 0 and 1. Parameter for the brightness.
 
@@ -160,13 +473,59 @@ def domain_coloring_illuminated(x, y, f,
 
         log_contrast :: Float. Parameter for the brightness.
 
+        isolines, n_phase, modulus_base :: Draw lines of constant 
+                                           phase and module over 
+                                           the image. See colorize.
+
         figsize, xlabel, ylabel, title and grid are parameters 
         for the Matplotlib plot.
+
+        progressive :: Boolean. If True, f must be an elementwise 
+                       callable. A 1/16 resolution preview is 
+                       drawn first and then refined in passes 
+                       (1/4, then full resolution) reusing the 
+                       samples already computed.
+
+        supersample :: Integer. If greater than 1, f must be an 
+                       elementwise callable. Each pixel is then the 
+                       average color of supersample*supersample 
+                       samples of f, which removes the moire near 
+                       poles and essential singularities.
+
+        jitter :: Boolean. If True, the supersamples are randomly 
+                  placed inside each pixel.
+
+        band_rows, workers :: Integers. The supersampled image is 
+                              computed in bands of band_rows rows 
+                              (reduced to the output resolution 
+                              one at a time) using workers threads.
     """
     
-    img = colorize(f, a, log_brightness, log_contrast)
-    arg_f = np.mod(np.angle(f),2*np.pi) # np.mod ensures argument from 0 to 2*pi
-    lim = np.max([x, y])
+    if progressive == True and supersample > 1:
+        raise ValueError("progressive and supersample cannot be used together.")
+    if supersample > 1 and not callable(f):
+        raise ValueError("supersample needs f as a callable of z.")
+    
+    if progressive == True and not callable(f):
+        raise ValueError("progressive needs f as a callable of z.")
+    
+    x, y, extent = _grid(x, y, None if callable(f) else np.shape(f), extent)
+    img_extent = extent
+    
+    if progressive == True:
+        samples = _progressive_samples(x + 1j*y, f)
+        f, img_extent = next(samples)
+    elif callable(f) and supersample == 1:
+        f = f(x + 1j*y)
+    
+    if supersample > 1:
+        # Isolines are measured in output pixels.
+        render = lambda f: colorize(f, a, log_brightness, log_contrast, isolines, n_phase, modulus_base, 
+                                    pixel_scale=supersample)[::-1]
+        img = _supersampled_image(x, y, f, render, supersample, jitter, band_rows, workers, 
+                                  halo=isolines)[::-1]
+    else:
+        img = colorize(f, a, log_brightness, log_contrast, isolines, n_phase, modulus_base)
 
     # initializing the colormap machinery
     norm = matplotlib.colors.Normalize(vmin=0,vmax=2*np.pi)
@@ -181,8 +540,8 @@ def domain_coloring_illuminated(x, y, f,
     ax.set_ylabel(ylabel, fontsize=14)
     
     # Limit corrections
-    ax.set_xlim((-lim,lim))
-    ax.set_ylim((-lim,lim))
+    ax.set_xlim(extent[:2])
+    ax.set_ylim(extent[2:])
     
     # Grid and title
     ax.grid(grid)
@@ -191,13 +550,23 @@ def domain_coloring_illuminated(x, y, f,
         ax.set_title(title, fontsize=18, pad=20, usetex=False)
     
     #ax.contourf(x, y, arg_f, cmap="hsv", levels=50, alpha=1)
-    ax.imshow(img, extent=[-lim,lim,-lim,lim], interpolation="none", origin="upper")
+    im = ax.imshow(img, extent=img_extent, interpolation="none", origin="upper")
    
     # Draw the colorbar 
     cbar = plt.colorbar(s_m, ticks=[0, np.pi/2, np.pi, 3*np.pi/2, 2*np.pi], pad=0.1)
     cbar.ax.set_yticklabels(["$0$", "$\\frac{\\pi}{2}$", "$\\pi$", "$\\frac{3\\pi}{2}$", "$2\\pi$"], fontsize=16)
     
     plt.tight_layout()
+    
+    # Refine the preview in place.
+    if progressive == True:
+        plt.show(block=False)
+        plt.pause(0.001)
+        for f, img_extent in samples:
+            im.set_data(colorize(f, a, log_brightness, log_contrast, isolines, n_phase, modulus_base))
+            im.set_extent(img_extent)
+            plt.pause(0.001)
+    
     plt.show()
     
     
@@ -212,7 +581,8 @@ def complex_plot3D(x, y, f,
                    title=None,
                    grid=True,                    
                    contour3D=False,
-                   log_mode=True):
+                   log_mode=True,
+                   extent=None):
     
     """
     3D plot representing he evaluated complex function f. 
@@ -226,11 +596,16 @@ def complex_plot3D(x, y, f,
 
     Arguments:
 
-        x, y :: 2D arrays. They represent the 2D plotting space.
+        x, y :: 2D meshgrids or 1D axis vectors. They represent 
+                the 2D plotting space. They can be None if extent 
+                is given.
 
         f :: 2D numpy array of complex numbers. Evaluated 
              function to be plotted.
 
+        extent :: Tuple (xmin, xmax, ymin, ymax). Plotting space 
+                  of f, used instead of x and y.
+
         f_lim :: Float greater than 0. Set the limit of the 
                  vertical axis. Improves the visualization in 
                  case the module diverges to infinity.
@@ -246,13 +621,15 @@ def complex_plot3D(x, y, f,
         for Matplotlib.
     """
     
+    x, y, extent = _grid(x, y, np.shape(f), extent)
+    x, y = np.broadcast_arrays(x, y) # Views, no meshgrid is copied.
+    
     if log_mode == True:
         abs_f = np.log2(np.abs(f)+1)
     if log_mode == False:
         abs_f = np.abs(f)
         
     arg_f = np.mod(np.angle(f),2*np.pi) # np.mod ensures argument from 0 to 2*pi
-    lim = np.max([x, y])
 
     # initializing the colormap machinery
     norm = matplotlib.colors.Normalize(vmin=0,vmax=2*np.pi)
@@ -270,9 +647,9 @@ def complex_plot3D(x, y, f,
     
     # Limit corrections
     abs_f[abs_f > f_lim] = f_lim
-    lim = 0.96*lim
-    ax.set_xlim((-lim,lim))
-    ax.set_ylim((-lim,lim))
+    x_c, y_c = (extent[0]+extent[1])/2, (extent[2]+extent[3])/2
+    ax.set_xlim((x_c+0.96*(extent[0]-x_c), x_c+0.96*(extent[1]-x_c)))
+    ax.set_ylim((y_c+0.96*(extent[2]-y_c), y_c+0.96*(extent[3]-y_c)))
     ax.set_zlim((0,f_lim))
     
     # Grid and title
@@ -311,7 +688,8 @@ def plot_re_im(x, y, f,
                grid=True,                    
                contour=False,
                cmap="viridis",
-               synchronize_rotations=False):
+               synchronize_rotations=False,
+               extent=None):
 
     """
     Plot the real and the imaginary parts of the function 
@@ -321,12 +699,16 @@ def plot_re_im(x, y, f,
     
     Arguments:
 
-        x, y :: 2D arrays. They represent the 2D plotting 
-                space.
+        x, y :: 2D meshgrids or 1D axis vectors. They represent 
+                the 2D plotting space. They can be None if extent 
+                is given.
 
         f :: 2D numpy array of complex numbers. Evaluated 
              function to be plotted.
 
+        extent :: Tuple (xmin, xmax, ymin, ymax). Plotting space 
+                  of f, used instead of x and y.
+
         synchronize_rotations :: Boolean. If True, when using
                                  the Matplotlib's interactive
                                  plotting window and rotating
@@ -337,7 +719,8 @@ def plot_re_im(x, y, f,
         parameters for Matplotlib.
     """
     
-    lim = np.max([x, y])
+    x, y, extent = _grid(x, y, np.shape(f), extent)
+    x, y = np.broadcast_arrays(x, y) # Views, no meshgrid is copied.
     
     # A figure and a 3d subplot
     fig = plt.figure(figsize=figsize)
@@ -352,11 +735,11 @@ def plot_re_im(x, y, f,
     ax_im.set_ylabel("Im", fontsize=14)
     ax_im.set_title("Im $f(z)$", fontsize=18)
     
-    ax_re.set_xlim((-lim,lim))
-    ax_re.set_ylim((-lim,lim))
+    ax_re.set_xlim(extent[:2])
+    ax_re.set_ylim(extent[2:])
     
-    ax_im.set_xlim((-lim,lim))
-    ax_im.set_ylim((-lim,lim))
+    ax_im.set_xlim(extent[:2])
+    ax_im.set_ylim(extent[2:])
     
     # Grid and title
     ax_re.grid(grid)
@@ -402,7 +785,8 @@ def complex_vector_field(x, y, f,
                          grid=False,
                          cmap=None,
                          dark_background=False,
-                         norm=False):
+                         norm=False,
+                         extent=None):
     
     """
     Plot the complex function f as a 2D vector field.
@@ -413,12 +797,16 @@ def complex_vector_field(x, y, f,
 
     Arguments:
 
-        x, y :: 2D arrays. They represent the 2D plotting 
-                space.
+        x, y :: 2D meshgrids or 1D axis vectors. They represent 
+                the 2D plotting space. They can be None if extent 
+                is given.
 
         f :: 2D numpy array of complex numbers. Evaluated 
              function to be plotted.
 
+        extent :: Tuple (xmin, xmax, ymin, ymax). Plotting space 
+                  of f, used instead of x and y.
+
         dark_background :: Boolean. If True, sets the axis 
                            background color to black.
 
@@ -428,6 +816,9 @@ def complex_vector_field(x, y, f,
         Matplotlib.
     """
 
+    x, y, extent = _grid(x, y, np.shape(f), extent)
+    x, y = np.broadcast_arrays(x, y) # Views, no meshgrid is copied.
+    
     # Vector normalization.
     if norm == True:
         r = np.sqrt(f.real**2+f.imag**2)
@@ -502,7 +893,8 @@ def complex_streamplot(x, y, f,
                        pointalpha=1, 
                        pointedgecolors="black", 
                        pointlw=1.5, 
-                       pointmarker="o"):
+                       pointmarker="o",
+                       extent=None):
     
     """
     Plot the complex function f as a 2D streamplot.
@@ -518,12 +910,16 @@ def complex_streamplot(x, y, f,
 
     Arguments:
 
-        x, y :: 2D arrays. They represent the 2D plotting 
-                space.
+        x, y :: 2D meshgrids or 1D axis vectors. They represent 
+                the 2D plotting space. They can be None if extent 
+                is given.
 
         f :: 2D numpy array of complex numbers. Evaluated 
              function to be plotted.
 
+        extent :: Tuple (xmin, xmax, ymin, ymax). Plotting space 
+                  of f, used instead of x and y.
+
         dark_background :: Boolean. If True, sets the axis 
                            background color to black.
 
@@ -545,6 +941,10 @@ def complex_streamplot(x, y, f,
         are passed to Matplotlib.
     """
 
+    # The streamplot only needs the axis vectors.
+    x, y, extent = _grid(x, y, np.shape(f), extent)
+    x, y = x[0,:], y[:,0]
+    
     # Create the figure and the axis.
     fig = plt.figure(figsize=figsize)
     ax = fig.add_subplot(111)
@@ -640,7 +1040,8 @@ def complex_contour(x, y, f,
                     pointmarker="o",
                     dark_background=False,
                     imshow=False,
-                    imcmap="coolwarm"):
+                    imcmap="coolwarm",
+                    extent=None):
         
     """
     Plot either the real or the imaginary part of f (or 
@@ -649,12 +1050,16 @@ def complex_contour(x, y, f,
 
     Arguments:
 
-        x, y :: 2D arrays. They represent the 2D plotting 
-                space.
+        x, y :: 2D meshgrids or 1D axis vectors. They represent 
+                the 2D plotting space. They can be None if extent 
+                is given.
 
         f :: 2D numpy array of complex numbers. Evaluated 
              function to be plotted.
 
+        extent :: Tuple (xmin, xmax, ymin, ymax). Plotting space 
+                  of f, used instead of x and y.
+
         mode :: "real", "imag", "modulus" or "both". 
                 Choose between plotting the contour of 
                 either the real part of f, the imaginary 
@@ -684,8 +1089,9 @@ def complex_contour(x, y, f,
                   used if imshow=True and mode!="both").
     """
     
-    # Get the limit for the plot.
-    lim = np.max([x, y])  
+    # Get the limits for the plot.
+    x, y, extent = _grid(x, y, np.shape(f), extent)
+    x, y = np.broadcast_arrays(x, y) # Views, no meshgrid is copied.
 
     # Create the figure and the axis.
     fig = plt.figure(figsize=figsize)
@@ -695,8 +1101,8 @@ def complex_contour(x, y, f,
     ax.set_ylabel(ylabel, fontsize=14, usetex=usetex)
     
     # Limit corrections
-    ax.set_xlim((-lim,lim))
-    ax.set_ylim((-lim,lim))
+    ax.set_xlim(extent[:2])
+    ax.set_ylim(extent[2:])
     
     # Decide whether the subplot's axis is shown or not.
     ax.axis(axis)
@@ -735,7 +1141,7 @@ def complex_contour(x, y, f,
             ax.clabel(cont, fontsize=9, inline=1)
             
         if imshow == True:
-            ax.imshow(np.array(f2, dtype=float), cmap=imcmap, extent=[-lim,lim,-lim,lim], interpolation="none", origin="lower") #cmap="GnBu" #force float type in f
+            ax.imshow(np.array(f2, dtype=float), cmap=imcmap, extent=extent, interpolation="none", origin="lower") #cmap="GnBu" #force float type in f
         
     if mode == "both":
         
@@ -770,3 +1176,974 @@ def complex_contour(x, y, f,
         
     plt.tight_layout()
     plt.show()
+
+
+
+def complex_animation(x, y, f, ts,
+                      kind="domain_coloring",
+                      output=None,
+                      figsize=(12,8),
+                      dpi=None,
+                      xlabel="Re", 
+                      ylabel="Im",
+                      title=None,
+                      grid=False,
+                      cmap="hsv",
+                      a=0.5,
+                      log_brightness=True,
+                      log_contrast=0.4,
+                      norm=False):
+    
+    """
+    Animate the family of complex functions f(z, t).
+    
+    The figure, the colorbar and the layout are built once. For 
+    every frame only f is evaluated again and the data of the 
+    existing artist is replaced (set_data for the images, 
+    set_UVC for the vector field). f is evaluated for frame k+1 
+    in a worker thread while frame k is being drawn and written.
+    
+    Returns the achieved number of frames per second.
+
+    Arguments:
+
+        x, y :: 2D meshgrids or 1D axis vectors. They represent 
+                the 2D plotting space.
+
+        f :: Callable f(z, t) returning a 2D numpy array of 
+             complex numbers.
+
+        ts :: 1D array. Values of the parameter t, one per frame.
+
+        kind :: "domain_coloring", "illuminated" or 
+                "vector_field". Type of plot, as drawn by 
+                domain_coloring, domain_coloring_illuminated 
+                and complex_vector_field.
+
+        output :: None, a string or a binary file object. If None, 
+                  the frames are shown on screen. A string is a 
+                  pattern for numbered PNG files such as 
+                  "frames/frame_%04d.png". A file object (for 
+                  example the stdin of an ffmpeg process reading 
+                  -f rawvideo -pix_fmt rgb24) receives the raw 
+                  RGB bytes of each frame.
+
+        figsize, dpi, xlabel, ylabel, title, grid and cmap are 
+        parameters for Matplotlib.
+
+        a, log_brightness and log_contrast are used if 
+        kind="illuminated". See colorize.
+
+        norm :: Boolean. If True and kind="vector_field", 
+                normalizes the vectors.
+    
+    Unlike the other plotting functions there is no extent 
+    parameter: f is a callable, so the resolution has to come 
+    from x and y. Any rectangular extent can be given with 1D 
+    x and y vectors.
+    """
+    
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    
+    x, y, extent = _grid(x, y)
+    z = x + 1j*y
+    
+    # Data for the artists, computed in the worker thread.
+    def evaluate(t):
+        f_t = np.asarray(f(z, t))
+        if kind == "domain_coloring":
+            return np.mod(np.angle(f_t),2*np.pi)
+        if kind == "illuminated":
+            return colorize(f_t, a, log_brightness, log_contrast)
+        if kind == "vector_field":
+            if norm == True:
+                f_t = f_t/np.abs(f_t)
+            return np.real(f_t), np.imag(f_t), np.mod(np.angle(f_t),2*np.pi)
+        raise ValueError('kind must be "domain_coloring", "illuminated" or "vector_field".')
+    
+    if len(ts) == 0:
+        raise ValueError("ts must contain at least one value of t.")
+    
+    data = evaluate(ts[0])
+    
+    # Prepare for using colormaps.
+    c_norm = matplotlib.colors.Normalize(vmin=0,vmax=2*np.pi)
+    s_m = matplotlib.cm.ScalarMappable(cmap=cmap if kind != "illuminated" else "hsv", norm=c_norm)
+    s_m.set_array([])
+    
+    # Create the figure and the axis.
+    fig = plt.figure(figsize=figsize, dpi=dpi)
+    
+    # The figure is closed even if drawing or writing a frame fails.
+    try:
+        ax = fig.add_subplot(111)
+        ax.set_xlabel(xlabel, fontsize=14)
+        ax.set_ylabel(ylabel, fontsize=14)
+        ax.set_xlim(extent[:2])
+        ax.set_ylim(extent[2:])
+        ax.grid(grid)
+        
+        if title is not None:
+            ax.set_title(title, fontsize=18, pad=20, usetex=False)
+        
+        if kind == "domain_coloring":
+            artist = ax.imshow(data, cmap=cmap, norm=c_norm, extent=extent, interpolation="none", origin="lower")
+            update = artist.set_data
+        if kind == "illuminated":
+            artist = ax.imshow(data, extent=extent, interpolation="none", origin="upper")
+            update = artist.set_data
+        if kind == "vector_field":
+            ax.set_aspect("equal")
+            X, Y = np.broadcast_arrays(x, y)
+            artist = ax.quiver(X, Y, *data, cmap=cmap, norm=c_norm, pivot="middle", headwidth=6, headlength=7)
+            update = lambda data: artist.set_UVC(*data)
+        
+        # Draw the colorbar.
+        cbar = plt.colorbar(s_m, ax=ax, ticks=[0, np.pi/2, np.pi, 3*np.pi/2, 2*np.pi], pad=0.1)
+        cbar.ax.set_yticklabels(["$0$", "$\\frac{\\pi}{2}$", "$\\pi$", "$\\frac{3\\pi}{2}$", "$2\\pi$"], fontsize=16)
+        
+        plt.tight_layout()
+        
+        if output is None:
+            plt.show(block=False)
+        
+        start = time.perf_counter()
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            
+            for k in range(len(ts)):
+                
+                # Evaluate the next frame while this one is drawn.
+                if k+1 < len(ts):
+                    future = executor.submit(evaluate, ts[k+1])
+                
+                update(data)
+                
+                if output is None:
+                    plt.pause(0.001)
+                elif isinstance(output, str):
+                    fig.savefig(output % k)
+                else:
+                    fig.canvas.draw()
+                    output.write(np.asarray(fig.canvas.buffer_rgba())[:,:,:3].tobytes())
+                
+                if k+1 < len(ts):
+                    data = future.result()
+        
+        fps = len(ts)/(time.perf_counter() - start)
+        
+        if output is None:
+            plt.show()
+    finally:
+        plt.close(fig)
+    
+    return fps
+
+
+
+def _refine_polylines(f, param, n_lines, n_samples, max_angle, max_length, max_depth):
+    
+    """
+    Auxiliar function for conformal_grid_lines.
+    
+    Maps n_lines parametrized lines z = param(ids, t), with t 
+    from 0 to 1, through f. All the lines are sampled together 
+    and every segment of the image is subdivided (only the new 
+    midpoints are evaluated) while it is longer than max_length 
+    or the image turns more than max_angle at one of its ends.
+    
+    Returns the sorted arrays ids, t and w = f(param(ids, t)).
+    """
+    
+    ids = np.repeat(np.arange(n_lines), n_samples)
+    t = np.tile(np.linspace(0, 1, n_samples), n_lines)
+    
+    with np.errstate(all="ignore"):
+        
+        w = np.asarray(f(param(ids, t)), dtype=complex)
+        finite = np.isfinite(w)
+        
+        # Default segment length: a fraction of the size of the image.
+        if max_length is None:
+            re = np.percentile(w[finite].real, [5, 95]) if finite.any() else [0, 1]
+            im = np.percentile(w[finite].imag, [5, 95]) if finite.any() else [0, 1]
+            max_length = np.hypot(re[1]-re[0], im[1]-im[0])/100 or 1e-2
+        
+        for depth in range(max_depth):
+            
+            same = ids[1:] == ids[:-1]
+            dw = w[1:] - w[:-1]
+            length = np.abs(dw)
+            
+            # Turning angle of the image at every inner vertex.
+            turn = np.abs(np.angle(dw[1:]/dw[:-1]))
+            turn[~(same[1:] & same[:-1])] = 0
+            turn = np.nan_to_num(turn) > max_angle
+            bend = np.zeros(len(dw), dtype=bool)
+            bend[1:] |= turn
+            bend[:-1] |= turn
+            
+            refine = same & np.isfinite(length) & ((length > max_length) | bend)
+            if not refine.any():
+                break
+            
+            new_ids = ids[:-1][refine]
+            new_t = 0.5*(t[:-1][refine] + t[1:][refine])
+            new_w = np.asarray(f(param(new_ids, new_t)), dtype=complex)
+            
+            ids = np.concatenate([ids, new_ids])
+            t = np.concatenate([t, new_t])
+            w = np.concatenate([w, new_w])
+            order = np.lexsort((t, ids))
+            ids, t, w = ids[order], t[order], w[order]
+    
+    return ids, t, w, max_length
+
+
+
+def _split_polylines(ids, w, pole_length):
+    
+    """
+    Auxiliar function for conformal_grid_lines.
+    
+    Splits the refined samples into polylines, breaking them 
+    between different lines, at non-finite values and at 
+    segments longer than pole_length (jumps across a pole).
+    """
+    
+    finite = np.isfinite(w)
+    
+    with np.errstate(invalid="ignore"):
+        jump = np.abs(w[1:] - w[:-1]) > pole_length
+    
+    breaks = (ids[1:] != ids[:-1]) | ~finite[1:] | ~finite[:-1] | jump
+    pieces = np.split(np.arange(len(w)), np.nonzero(breaks)[0] + 1)
+    
+    return [w[p] for p in pieces if len(p) > 1 and finite[p].all()]
+
+
+
+def conformal_grid_lines(f, 
+                         mode="cartesian",
+                         xlim=(-1,1),
+                         ylim=(-1,1),
+                         rlim=(0,1),
+                         thetalim=(0,2*np.pi),
+                         n_lines=11,
+                         n_samples=32,
+                         max_angle=0.1,
+                         max_length=None,
+                         max_depth=10):
+    
+    """
+    Map a grid of lines of the z plane through the function f.
+    
+    The lines are first sampled with n_samples points each and 
+    then the segments of their images are subdivided where the 
+    image is too long or too curved, so that few samples are 
+    spent on the straight parts. The images are split at poles. 
+    Matplotlib is not used, so this also works headlessly.
+    
+    Returns two lists of 1D arrays of complex numbers, one per 
+    family of lines. Each array is a polyline in the w plane.
+
+    Arguments:
+
+        f :: Callable. Complex function to be mapped. It must 
+             accept 1D numpy arrays of complex numbers.
+
+        mode :: "cartesian" or "polar". In cartesian mode the 
+                families are the lines Re z = const and 
+                Im z = const inside xlim and ylim. In polar mode 
+                they are the circles |z| = const and the rays 
+                arg z = const inside rlim and thetalim.
+
+        n_lines :: Integer or tuple of two integers. Number of 
+                   lines of each family.
+
+        n_samples :: Integer. Initial number of samples per line.
+
+        max_angle :: Float. Maximum turning angle (in radians) 
+                     of the image between two segments.
+
+        max_length :: Float. Maximum length of an image segment. 
+                      By default, 1/100 of the image size.
+
+        max_depth :: Integer. Maximum number of subdivisions of 
+                     each initial segment. Segments that are still 
+                     longer than 10*max_length after max_depth 
+                     subdivisions are considered to cross a pole.
+    """
+    
+    if np.ndim(n_lines) == 0:
+        n_lines = (n_lines, n_lines)
+    
+    if mode == "cartesian":
+        
+        (x0, x1), (y0, y1) = xlim, ylim
+        xs = np.linspace(x0, x1, n_lines[0])
+        ys = np.linspace(y0, y1, n_lines[1])
+        
+        params = [lambda ids, t: xs[ids] + 1j*(y0 + t*(y1-y0)),  # Re z = const.
+                  lambda ids, t: (x0 + t*(x1-x0)) + 1j*ys[ids]]  # Im z = const.
+        
+    elif mode == "polar":
+        
+        (r0, r1), (th0, th1) = rlim, thetalim
+        full_turn = np.isclose(abs(th1-th0), 2*np.pi)
+        rs = np.linspace(r0, r1, n_lines[0])
+        ths = np.linspace(th0, th1, n_lines[1], endpoint=not full_turn)
+        
+        params = [lambda ids, t: rs[ids]*np.exp(1j*(th0 + t*(th1-th0))),  # |z| = const.
+                  lambda ids, t: (r0 + t*(r1-r0))*np.exp(1j*ths[ids])]    # arg z = const.
+        
+    else:
+        raise ValueError('mode must be "cartesian" or "polar".')
+    
+    families = []
+    
+    for param, n in zip(params, n_lines):
+        ids, t, w, length = _refine_polylines(f, param, n, n_samples, max_angle, max_length, max_depth)
+        families.append(_split_polylines(ids, w, 10*length))
+        
+    return families[0], families[1]
+
+
+
+def complex_grid_map(f, 
+                     mode="cartesian",
+                     xlim=(-1,1),
+                     ylim=(-1,1),
+                     rlim=(0,1),
+                     thetalim=(0,2*np.pi),
+                     n_lines=11,
+                     wlim=None,
+                     figsize=(8,8),
+                     xlabel="Re", 
+                     ylabel="Im",
+                     title=None,
+                     grid=False,
+                     colors=("C3","C0"),
+                     lw=1,
+                     dark_background=False,
+                     **kwargs):
+    
+    """
+    Plot the image through f of a cartesian or polar grid of 
+    lines of the z plane (conformal map plot). Both families 
+    of lines are drawn as a single LineCollection.
+
+    Arguments:
+
+        f :: Callable. Complex function to be mapped. It must 
+             accept 1D numpy arrays of complex numbers.
+
+        mode, xlim, ylim, rlim, thetalim and n_lines define the 
+        grid of lines. See conformal_grid_lines.
+
+        wlim :: Tuple (xmin, xmax, ymin, ymax). Limits of the 
+                plot in the w plane. By default, the axis is 
+                scaled to fit every line.
+
+        colors :: Tuple of two Matplotlib colors, one for each 
+                  family of lines.
+
+        dark_background :: Boolean. If True, sets the axis 
+                           background color to black.
+
+        figsize, xlabel, ylabel, title, grid and lw are 
+        parameters for Matplotlib.
+
+        Extra keyword arguments are passed to 
+        conformal_grid_lines.
+    """
+    
+    from matplotlib.collections import LineCollection
+    
+    lines_1, lines_2 = conformal_grid_lines(f, mode=mode, xlim=xlim, ylim=ylim, 
+                                            rlim=rlim, thetalim=thetalim, 
+                                            n_lines=n_lines, **kwargs)
+    
+    segments = [np.column_stack([w.real, w.imag]) for w in lines_1 + lines_2]
+    line_colors = [colors[0]]*len(lines_1) + [colors[1]]*len(lines_2)
+    
+    # Create the figure and the axis.
+    fig = plt.figure(figsize=figsize)
+    ax = fig.add_subplot(111)
+    ax.set_aspect("equal")
+    ax.set_xlabel(xlabel, fontsize=14)
+    ax.set_ylabel(ylabel, fontsize=14)
+    
+    ax.add_collection(LineCollection(segments, colors=line_colors, linewidths=lw))
+    
+    # Limit corrections.
+    if wlim is None:
+        ax.autoscale_view()
+    else:
+        ax.set_xlim(wlim[:2])
+        ax.set_ylim(wlim[2:])
+    
+    # Grid and title.
+    ax.grid(grid)
+    
+    if title is not None:
+        ax.set_title(title, fontsize=18, pad=20, usetex=False)
+        
+    # Dark background.
+    if dark_background == True:
+        ax.set_facecolor('black')
+        
+    plt.tight_layout()
+    plt.show()
+
+
+
+def _iterate_band(step, z, c, max_iter, escape_radius, tol, roots, degree):
+    
+    """
+    Auxiliar function for iterate_map. Iterates a 1D array of 
+    points, compacting the active points after every iteration 
+    so that finished points do not cost any more work.
+    """
+    
+    counts = np.full(z.shape, max_iter, dtype=int)
+    z_final = z.copy()
+    basins = np.full(z.shape, -1, dtype=int)
+    nu = np.full(z.shape, float(max_iter))
+    
+    active = np.arange(z.size)
+    
+    with np.errstate(all="ignore"):
+        
+        for n in range(1, max_iter+1):
+            
+            z_new = step(z, c)
+            done = np.zeros(z.shape, dtype=bool)
+            
+            if escape_radius is not None:
+                abs_z = np.abs(z_new)
+                escaped = ~(abs_z <= escape_radius) # Also catches nan.
+                # Smooth (fractional) iteration count.
+                nu[active[escaped]] = n - np.log(np.log(abs_z[escaped])/np.log(escape_radius))/np.log(degree)
+                done |= escaped
+                
+            if tol is not None:
+                
+                if roots is None:
+                    dist = np.abs(z_new - z)
+                    converged = (dist < tol) & ~done
+                else:
+                    dist_roots = np.abs(z_new[:,np.newaxis] - roots[np.newaxis,:])
+                    nearest = np.argmin(dist_roots, axis=1)
+                    dist = dist_roots[np.arange(z.size), nearest]
+                    converged = (dist < tol) & ~done
+                    basins[active[converged]] = nearest[converged]
+                
+                # Smooth iteration count for (quadratic) convergence.
+                frac = np.log(np.log(dist[converged])/np.log(tol))/np.log(degree)
+                nu[active[converged]] = n - np.clip(np.nan_to_num(frac, nan=0, posinf=1), 0, 1)
+                done |= converged
+            
+            counts[active[done]] = n
+            z_final[active[done]] = z_new[done]
+            
+            # Keep only the active points.
+            keep = ~done
+            active, z, c = active[keep], z_new[keep], c[keep]
+            
+            if active.size == 0:
+                break
+    
+    z_final[active] = z
+    
+    return counts, z_final, basins, nu
+
+
+
+def iterate_map(x, y, step, 
+                z0=None,
+                max_iter=100,
+                escape_radius=None,
+                tol=None,
+                roots=None,
+                degree=2,
+                tile_rows=None,
+                workers=1):
+    
+    """
+    Iterate the map z -> step(z, c) over the whole grid at once, 
+    where c = x + 1j*y is the point of the grid. Can be used for 
+    escape-time fractals like z -> z**2 + c or for Newton's 
+    method on polynomials. Points that escape or converge are 
+    removed from the computation.
+    
+    Returns four arrays with the shape of the grid: the iteration 
+    counts (max_iter for points that did not finish), the final 
+    values of z, the basin indices (index of the root reached, or 
+    -1) and the smooth iteration counts. The results can be 
+    plotted with iteration_field and domain_coloring_illuminated.
+
+    Arguments:
+
+        x, y :: 2D meshgrids or 1D axis vectors. They represent 
+                the 2D plotting space.
+
+        step :: Callable step(z, c) returning the next value of z. 
+                It must work elementwise on 1D numpy arrays.
+
+        z0 :: Complex number or 2D array. Initial value of z. By 
+              default, z starts at c (use z0=0 for the Mandelbrot 
+              set).
+
+        max_iter :: Integer. Maximum number of iterations.
+
+        escape_radius :: Float greater than 1. A point finishes 
+                         when |z| exceeds it.
+
+        tol :: Float lower than 1. A point finishes when it gets 
+               closer than tol to one of the roots or, if roots 
+               is None, when |step(z, c) - z| < tol.
+
+        roots :: List of complex numbers. Attractors (e.g. the 
+                 roots of the polynomial for Newton's method) used 
+                 for the basin indices.
+
+        degree :: Float. Order of the escape or of the convergence, 
+                  used for the smooth iteration counts. It is 2 
+                  for z**2 + c and for Newton's method on simple 
+                  roots.
+
+        tile_rows :: Integer. If given, the grid is processed in 
+                     bands of this number of rows.
+
+        workers :: Integer. Number of threads used to process the 
+                   bands in parallel.
+    """
+    
+    from concurrent.futures import ThreadPoolExecutor
+    
+    if escape_radius is None and tol is None:
+        raise ValueError("Give an escape_radius, a tol or both.")
+    
+    x, y, _ = _grid(x, y)
+    c = x + 1j*y
+    z = np.array(np.broadcast_to(c if z0 is None else z0, c.shape), dtype=complex)
+    if roots is not None:
+        roots = np.asarray(roots, dtype=complex)
+    
+    counts = np.empty(c.shape, dtype=int)
+    z_final = np.empty(c.shape, dtype=complex)
+    basins = np.empty(c.shape, dtype=int)
+    nu = np.empty(c.shape)
+    
+    if tile_rows is None:
+        tile_rows = c.shape[0] if workers == 1 else -(-c.shape[0]//workers)
+    bands = [slice(i, i+tile_rows) for i in range(0, c.shape[0], tile_rows)]
+    
+    def run(band):
+        out = _iterate_band(step, z[band].ravel(), c[band].ravel(), max_iter, escape_radius, tol, roots, degree)
+        shape = c[band].shape
+        counts[band], z_final[band], basins[band], nu[band] = [a.reshape(shape) for a in out]
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run, bands))
+    
+    return counts, z_final, basins, nu
+
+
+
+def iteration_field(nu, basins=None, n_basins=None, max_iter=None, hue_period=20):
+    
+    """
+    Auxiliar function for plotting the results of iterate_map.
+    
+    Returns a complex array to be drawn with colorize or 
+    domain_coloring_illuminated (with log_brightness=False). 
+    The module goes from 1 for points that finish right away 
+    to 0 for points that need max_iter iterations, so they are 
+    drawn from bright to black. The phase represents the basin 
+    index if basins and n_basins are given, and the smooth 
+    iteration count (a whole turn every hue_period iterations) 
+    otherwise.
+    """
+    
+    if max_iter is None:
+        max_iter = np.max(nu)
+        
+    modulus = 1 - np.log1p(np.clip(nu, 0, max_iter))/np.log1p(max_iter)
+    
+    if basins is not None and n_basins is not None:
+        phase = 2*np.pi*basins/n_basins
+        modulus = np.where(basins < 0, 0, modulus)
+    else:
+        phase = 2*np.pi*nu/hue_period
+        
+    return modulus*np.exp(1j*phase)
+
+
+
+# Modules whose functions are identified by their name in the cache keys.
+_STABLE_MODULES = ("numpy", "scipy", "math", "cmath", "builtins", "mpmath")
+
+
+
+def _hash_code(code, seen):
+    
+    """
+    Auxiliar function for GridCache.key.
+    
+    Returns a deterministic string representing a code object: 
+    its bytecode, its names and its constants, including the 
+    nested code objects (lambdas, comprehensions, inner 
+    functions) recursively.
+    """
+    
+    consts = []
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            consts.append(_hash_code(const, seen))
+        else:
+            text = _hash_material(const, seen)
+            if text is None:
+                return None
+            consts.append(text)
+    
+    return "code({}, {}, {}, ({}))".format(code.co_code.hex(), code.co_names, 
+                                           code.co_varnames, ", ".join(consts))
+
+
+
+def _code_names(code):
+    
+    """Return the global names used by code and its nested code objects."""
+    
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+
+def _hash_material(value, seen=None):
+    
+    """
+    Auxiliar function for GridCache.key.
+    
+    Returns a deterministic string representing value, or None 
+    if there is none. Python functions are represented by their 
+    code and by every value they capture (defaults, closure 
+    variables and the globals used by them or by their nested 
+    code), recursively. Callable objects are represented by 
+    their type's __call__ and their attributes. Arrays are 
+    represented by their bytes, modules and numpy (or standard 
+    library) functions by their names, and other objects by 
+    their repr.
+    """
+    
+    if seen is None:
+        seen = set()
+    
+    if isinstance(value, (list, tuple)):
+        parts = [_hash_material(v, seen) for v in value]
+        if any(p is None for p in parts):
+            return None
+        return "(" + ", ".join(parts) + ")"
+    
+    if isinstance(value, dict):
+        return _hash_material(sorted(value.items(), key=lambda item: repr(item[0])), seen)
+    
+    if isinstance(value, np.ndarray):
+        return "array({}, {}, {})".format(value.dtype.str, value.shape, 
+                                          hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest())
+    
+    if inspect.ismodule(value):
+        return "module " + value.__name__
+    
+    if isinstance(value, np.ufunc):
+        return "ufunc " + value.__name__
+    
+    if inspect.isbuiltin(value) or (inspect.isfunction(value) and 
+                                    str(getattr(value, "__module__", None)).split(".")[0] in _STABLE_MODULES):
+        return "function {}.{}".format(value.__module__, value.__qualname__)
+    
+    if inspect.isclass(value):
+        return "class {}.{}".format(value.__module__, value.__qualname__)
+    
+    if id(value) in seen:
+        # Recursive reference, already being represented.
+        return "recursion"
+    
+    if inspect.isfunction(value):
+        seen = seen | {id(value)}
+        code = _hash_code(value.__code__, seen)
+        cells = []
+        for cell in value.__closure__ or []:
+            try:
+                cells.append(cell.cell_contents)
+            except ValueError:
+                cells.append("empty cell")
+        f_globals = value.__globals__
+        used = [(name, f_globals[name]) for name in sorted(_code_names(value.__code__)) if name in f_globals]
+        captured = _hash_material([value.__defaults__, value.__kwdefaults__, cells, used], seen)
+        if code is None or captured is None:
+            return None
+        return "function " + code + " " + captured
+    
+    if inspect.ismethod(value):
+        return _hash_material([value.__func__, value.__self__], seen | {id(value)})
+    
+    if isinstance(value, functools.partial):
+        return _hash_material([value.func, value.args, value.keywords], seen | {id(value)})
+    
+    if callable(value):
+        # Callable object: its __call__ and its attributes.
+        call = getattr(type(value), "__call__", None)
+        if not inspect.isfunction(call) or not hasattr(value, "__dict__"):
+            return None
+        text = _hash_material([call, vars(value)], seen | {id(value)})
+        return None if text is None else "object " + type(value).__qualname__ + " " + text
+    
+    text = repr(value)
+    if " at 0x" in text:
+        # Default repr containing the memory address.
+        return None
+    
+    return text
+
+
+
+class GridCache:
+    
+    """
+    Persistent on-disk cache of evaluated functions.
+    
+    Evaluating an expensive f over the same meshgrid again and 
+    again before calling domain_coloring, complex_plot3D or 
+    complex_contour can be avoided by evaluating it through a 
+    GridCache. Each result is stored as an uncompressed .npy 
+    file whose name is a hash of the function's code (or of the 
+    expression), the values it captures (default arguments, 
+    closure variables and the globals used, followed recursively 
+    into the functions it calls), the coordinates of the grid 
+    and the dtype. Cached arrays are loaded read-only via mmap, 
+    so reusing them does not copy the data.
+    
+    Functions that cannot be inspected, or that capture values 
+    that cannot be hashed deterministically, are evaluated 
+    without caching.
+    
+    When the total size of the cache exceeds max_bytes, the 
+    least recently used files are deleted. Files are written to 
+    a temporary name and atomically renamed, so several 
+    processes can share the same cache directory.
+
+    Arguments:
+
+        cache_dir :: String. Directory for the cached arrays. 
+                     Defaults to ~/.cache/cplotting_tools.
+
+        max_bytes :: Integer. Size cap of the cache in bytes.
+
+    Usage:
+
+        cache = GridCache()
+        f = cache.evaluate(lambda z: np.cos(z)/z, x, y)
+        cplt.domain_coloring(x, y, f)
+        print(cache.hits, cache.misses)
+    """
+    
+    # Age (in seconds) after which a temporary file left behind by 
+    # an interrupted write is considered stale.
+    stale_tmp_age = 600
+    
+    def __init__(self, cache_dir=None, max_bytes=2**30):
+        
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "cplotting_tools")
+        os.makedirs(cache_dir, exist_ok=True)
+        
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        
+    
+    def key(self, f, x, y, dtype=complex):
+        
+        """
+        Return the hash identifying f evaluated over the grid 
+        defined by x and y with the given dtype.
+        
+        f is either a callable of z or a string expression 
+        in z (see evaluate). Returns None if f cannot be 
+        identified deterministically (see _hash_material).
+        """
+        
+        if isinstance(f, str):
+            source = "expression " + f
+        else:
+            source = _hash_material(f)
+            if source is None:
+                return None
+        
+        # Rectilinear grids are identified by their axis vectors 
+        # (O(N) to hash). Other 2D grids are hashed in full.
+        x, y, _ = _grid(x, y)
+        x_axis, y_axis = x[:1,:], y[:,:1]
+        if not (np.array_equal(np.broadcast_to(x_axis, x.shape), x) and 
+                np.array_equal(np.broadcast_to(y_axis, y.shape), y)):
+            x_axis, y_axis = x, y
+        
+        material = "\n".join([source, 
+                              _hash_material(np.asarray(x_axis, dtype=float)), 
+                              _hash_material(np.asarray(y_axis, dtype=float)), 
+                              repr(np.broadcast_shapes(x.shape, y.shape)), 
+                              np.dtype(dtype).str])
+        
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+    
+    
+    def evaluate(self, f, x, y, dtype=complex):
+        
+        """
+        Return f evaluated at z = x + 1j*y, reading it from the 
+        cache if possible. The returned array is a read-only 
+        memory map.
+        
+        Arguments:
+
+            f :: Callable taking a 2D numpy array of complex 
+                 numbers, or a string expression in z such as 
+                 "(z**2-1)/(z+1j)". Numpy is available in the 
+                 expression as np.
+
+            x, y :: 2D meshgrids or 1D axis vectors. They 
+                    represent the 2D plotting space.
+
+            dtype :: Numpy dtype of the stored array.
+        """
+        
+        key = self.key(f, x, y, dtype)
+        
+        if key is None:
+            # Not cacheable, evaluate it directly.
+            self.misses += 1
+            x, y, _ = _grid(x, y)
+            values = f(x + 1j*y)
+            return np.ascontiguousarray(np.broadcast_to(values, np.broadcast_shapes(x.shape, y.shape)), dtype=dtype)
+        
+        path = os.path.join(self.cache_dir, key + ".npy")
+        
+        try:
+            values = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            values = None
+            
+        if values is not None:
+            self.hits += 1
+            # Refresh the modification time, used for the LRU ordering.
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return values
+        
+        self.misses += 1
+        x, y, _ = _grid(x, y)
+        z = x + 1j*y
+        
+        if isinstance(f, str):
+            values = eval(f, {"__builtins__": {}, "np": np, "z": z})
+        else:
+            values = f(z)
+        values = np.ascontiguousarray(np.broadcast_to(values, z.shape), dtype=dtype)
+        
+        # Write to a temporary file first so that other processes 
+        # never read a partially written array.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.save(file, values)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another process holds the same (identical) array open.
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            
+        self._evict()
+        
+        try:
+            return np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            # Evicted right away by a concurrent process.
+            return values
+    
+    
+    def _evict(self):
+        
+        """
+        Delete the temporary files left behind by interrupted writes 
+        and the least recently used arrays until the cache fits in 
+        max_bytes.
+        """
+        
+        import time
+        
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith((".npy", ".tmp")):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            
+            if name.endswith(".tmp"):
+                # Temporary files being written count towards the size, 
+                # stale ones are removed.
+                if time.time() - stat.st_mtime > self.stale_tmp_age:
+                    try:
+                        os.remove(path)
+                        continue
+                    except OSError:
+                        pass
+                total += stat.st_size
+                continue
+            
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Still memory-mapped somewhere (Windows), try the next one.
+                continue
+            total -= size
+    
+    
+    def clear(self):
+        
+        """
+        Delete every cached array and temporary file and reset the 
+        hit/miss counters.
+        """
+        
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".npy", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    # Already deleted, or still memory-mapped (Windows).
+                    pass
+        
+        self.hits = 0
+        self.misses = 0
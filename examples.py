@@ -30,6 +30,10 @@ z = x + 1j*y
 f = (z**2-1)*(z-2-1j)**2/(z**2+2+2j)
 pts = [-1, 1, 2+1j, 2**(3/4)*np.exp(1j*(5*np.pi/8)), 2**(3/4)*np.exp(1j*(5*np.pi/8+np.pi))]
 
+# Evaluate f through an on-disk cache instead (reused across runs).
+# cache = cplt.GridCache()
+# f = cache.evaluate("(z**2-1)*(z-2-1j)**2/(z**2+2+2j)", x, y)
+
 cplt.domain_coloring(x, y, f, cmap="hsv")
 # cplt.domain_coloring(x, y, f, cmap="twilight_r")
 
@@ -60,4 +64,28 @@ cplt.domain_coloring(x, y, f, cmap="hsv")
 # cplt.complex_vector_field(x, y, f, norm=False)
 # cplt.complex_vector_field(x, y, f, norm=True)
 # cplt.complex_vector_field(x, y, f, cmap="hsv", norm=False)
-# cplt.complex_vector_field(x, y, f, cmap="hsv", norm=True)
\ No newline at end of file
+# cplt.complex_vector_field(x, y, f, cmap="hsv", norm=True)
+
+# cplt.complex_grid_map(np.cos, xlim=(-lim,lim), ylim=(-1,1), wlim=(-4,4,-4,4))
+# cplt.complex_grid_map(np.cos, mode="polar", rlim=(0,2))
+
+#============================== Iterated maps.
+
+# x = np.linspace(-2, 2, 600)
+# y = np.linspace(-2, 2, 600)
+# roots = np.exp(2j*np.pi*np.arange(3)/3)
+# newton = lambda z, c: z - (z**3-1)/(3*z**2)
+# counts, z_final, basins, nu = cplt.iterate_map(x, y, newton, max_iter=50, tol=1e-6, roots=roots, workers=4)
+# cplt.domain_coloring_illuminated(x, y, cplt.iteration_field(nu, basins, 3, 50), log_brightness=False)
+
+# x = np.linspace(-2.2, 0.8, 600)
+# y = np.linspace(-1.3, 1.3, 520)
+# counts, z_final, basins, nu = cplt.iterate_map(x, y, lambda z, c: z**2 + c, z0=0, max_iter=200, escape_radius=100)
+# cplt.domain_coloring_illuminated(x, y, cplt.iteration_field(nu, max_iter=200), log_brightness=False)
+
+
+#============================== Animation of f(z, t).
+
+# x = np.linspace(-3, 3, 300)
+# y = np.linspace(-2, 2, 200)
+# fps = cplt.complex_animation(x, y, lambda z, t: np.cos(z*np.exp(1j*t)), np.linspace(0, 2*np.pi, 120), output="frame_%04d.png")